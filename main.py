@@ -1,19 +1,106 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+from fastapi.responses import ORJSONResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any, List
+from contextlib import asynccontextmanager
+from functools import lru_cache
 import os
-import json
-import requests
+import re
+import time
+import logging
+import weakref
+import orjson
+import asyncio
+import httpx
+import redis.asyncio as redis
+from cerebras.cloud.sdk import AsyncCerebras, APIStatusError, APIConnectionError, APITimeoutError
 from urllib.parse import urlencode
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from google.auth import jwt
 import uvicorn
 
-app = FastAPI(title="Google Chatbot API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# Upstream connection pools, sized for peak concurrent requests per worker
+UPSTREAM_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+UPSTREAM_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Async HTTP client for Google APIs, created on startup and reused across requests
+google_client: Optional[httpx.AsyncClient] = None
+
+# In-process client used by /batch to dispatch sub-requests straight into the app
+batch_client: Optional[httpx.AsyncClient] = None
+BATCH_MAX_REQUESTS = 20
+# Marks requests issued by /batch itself, so nested batches can be rejected
+BATCH_SUBREQUEST_HEADER = "X-Batch-Subrequest"
+
+# Redis client for token storage, shared across workers. Tokens outlive the
+# 1h access token since they carry the refresh token used to renew it
+redis_client: Optional[redis.Redis] = None
+TOKEN_TTL_SECONDS = 30 * 24 * 3600
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+
+# Cerebras SDK client; keeps a warm connection pool of its own to api.cerebras.ai.
+# Left unset when CEREBRAS_API_KEY is missing
+cerebras_client: Optional[AsyncCerebras] = None
+
+def require_cerebras_client() -> AsyncCerebras:
+    if cerebras_client is None:
+        raise HTTPException(status_code=503, detail="Chat is not configured")
+    return cerebras_client
+
+async def warm_cerebras_connection(client: httpx.AsyncClient, base_url: httpx.URL):
+    """Open a keep-alive connection to Cerebras so the first chat skips the handshake"""
+    try:
+        await client.get(base_url.join("/v1/tcp_warming"), timeout=1)
+    except httpx.HTTPError as e:
+        logger.debug("Cerebras TCP warming failed: %r", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global google_client, batch_client, redis_client, cerebras_client
+    try:
+        google_client = httpx.AsyncClient(http2=True, limits=UPSTREAM_LIMITS, timeout=UPSTREAM_TIMEOUT)
+        batch_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+            base_url="http://batch",
+            headers={"Accept-Encoding": "identity", BATCH_SUBREQUEST_HEADER: "1"}
+        )
+        redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        
+        # A missing Cerebras key only disables chat; OAuth and Gmail keep working
+        if CEREBRAS_API_KEY:
+            cerebras_http = httpx.AsyncClient(http2=True, limits=UPSTREAM_LIMITS, timeout=UPSTREAM_TIMEOUT)
+            # The SDK's own warming opens a throwaway blocking client; instead open
+            # the first connection on the pool that chat requests actually use
+            cerebras_client = AsyncCerebras(
+                api_key=CEREBRAS_API_KEY,
+                http_client=cerebras_http,
+                warm_tcp_connection=False
+            )
+            await warm_cerebras_connection(cerebras_http, cerebras_client.base_url)
+        else:
+            logger.warning("CEREBRAS_API_KEY is not set; chat endpoints are disabled")
+        yield
+    finally:
+        if cerebras_client is not None:
+            await cerebras_client.close()
+        if redis_client is not None:
+            await redis_client.aclose()
+        if batch_client is not None:
+            await batch_client.aclose()
+        if google_client is not None:
+            await google_client.aclose()
+
+app = FastAPI(
+    title="Google Chatbot API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # CORS middleware
 app.add_middleware(
@@ -28,18 +115,98 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Chat-Intent"],
 )
 
+# Gzip compression that passes server-sent events through untouched, since the
+# compressor would otherwise hold back streamed tokens until enough data builds up
+class EventStreamAwareGZipResponder(GZipResponder):
+    passthrough = False
+    
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.passthrough = content_type.startswith("text/event-stream")
+        if self.passthrough:
+            await self.send(message)
+        else:
+            await super().send_with_gzip(message)
+
+class EventStreamAwareGZipMiddleware(GZipMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = EventStreamAwareGZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel
+            )
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+# Compress JSON responses large enough to benefit
+app.add_middleware(EventStreamAwareGZipMiddleware, minimum_size=1024)
+
 # Environment variables
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Google OAuth 2.0 endpoints and frontend redirect target
+GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/auth"
+GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+FRONTEND_URL = "https://v0-google-integration-chatbot.vercel.app"
+GOOGLE_ID_TOKEN_ISSUERS = {"https://accounts.google.com", "accounts.google.com"}
+
+# OAuth 2.0 authorization request parameters
+GOOGLE_SCOPES = " ".join([
+    'openid',
+    'email',
+    'profile',
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/calendar.readonly',
+    'https://www.googleapis.com/auth/drive.readonly'
+])
+GOOGLE_AUTH_PARAMS = {
+    "client_id": GOOGLE_CLIENT_ID,
+    "scope": GOOGLE_SCOPES,
+    "response_type": "code",
+    "access_type": "offline",
+    "prompt": "consent",
+}
+
+# Deployments are reached through one or two base URLs, so cache per base URL
+@lru_cache(maxsize=4)
+def oauth_redirect_uri(base_url: str) -> str:
+    return f"{base_url}/auth/google/callback"
+
+@lru_cache(maxsize=4)
+def google_auth_url(base_url: str) -> str:
+    params = {**GOOGLE_AUTH_PARAMS, "redirect_uri": oauth_redirect_uri(base_url)}
+    return f"{GOOGLE_AUTH_URL}?{urlencode(params)}"
 
 # Pydantic models
 class ChatMessage(BaseModel):
-    message: str
+    message: str = Field(..., min_length=1, max_length=8000)
     user_id: Optional[str] = None
 
+class BatchRequestItem(BaseModel):
+    id: str
+    method: str = "GET"
+    url: str
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+class BatchResponseItem(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResponseItem]
+
 class AuthResponse(BaseModel):
     auth_url: str
 
@@ -48,8 +215,106 @@ class ChatResponse(BaseModel):
     intent: Optional[str] = None
     data: Optional[Dict[str, Any]] = None
 
-# In-memory token storage (use Redis/database in production)
-user_tokens = {}
+# Transient upstream statuses are passed through so clients can retry with
+# backoff, and client-caused ones so callers can fix the request; any other
+# upstream failure is reported as a bad gateway
+RETRYABLE_UPSTREAM_STATUSES = {429, 503}
+CLIENT_UPSTREAM_STATUSES = {400, 403, 404}
+
+def upstream_error(service: str, response: httpx.Response) -> HTTPException:
+    """Map a failed upstream response to the HTTPException returned to clients"""
+    logger.warning("%s API error %s: %s", service, response.status_code, response.text)
+    passthrough = RETRYABLE_UPSTREAM_STATUSES | CLIENT_UPSTREAM_STATUSES
+    status_code = response.status_code if response.status_code in passthrough else 502
+    retry_after = response.headers.get("retry-after")
+    return HTTPException(
+        status_code=status_code,
+        detail=f"{service} API error",
+        headers={"Retry-After": retry_after} if retry_after else None
+    )
+
+def upstream_unavailable(service: str, exc: Exception) -> HTTPException:
+    """Map a failure to reach an upstream to a retryable HTTPException"""
+    logger.warning("%s API unreachable: %r", service, exc)
+    timed_out = isinstance(exc, (httpx.TimeoutException, APITimeoutError))
+    return HTTPException(status_code=504 if timed_out else 503, detail=f"{service} API unavailable")
+
+async def google_request(service: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a request through the Google pool, mapping transport failures"""
+    try:
+        return await google_client.request(method, url, **kwargs)
+    except httpx.TransportError as e:
+        raise upstream_unavailable(service, e)
+
+# Token storage in Redis, keyed by Google user id
+def token_key(user_id: str) -> str:
+    return f"tok:{user_id}"
+
+async def save_user_tokens(user_id: str, tokens: Dict[str, Any]):
+    if "expires_in" in tokens:
+        tokens = {**tokens, "expires_at": time.time() + tokens["expires_in"]}
+    await redis_client.set(token_key(user_id), orjson.dumps(tokens), ex=TOKEN_TTL_SECONDS)
+
+async def get_user_tokens(user_id: str) -> Optional[Dict[str, Any]]:
+    raw = await redis_client.get(token_key(user_id))
+    return orjson.loads(raw) if raw is not None else None
+
+# One lock per user so concurrent requests share a single refresh round-trip.
+# Held weakly, so a user's lock goes away once no request is using it
+_refresh_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def refresh_lock(user_id: str) -> asyncio.Lock:
+    lock = _refresh_locks.get(user_id)
+    if lock is None:
+        lock = _refresh_locks[user_id] = asyncio.Lock()
+    return lock
+
+def token_expiring(tokens: Dict[str, Any]) -> bool:
+    return tokens.get("expires_at", float("inf")) - time.time() < TOKEN_REFRESH_MARGIN_SECONDS
+
+async def refresh_user_tokens(
+    user_id: str,
+    tokens: Dict[str, Any],
+    rejected_access_token: Optional[str] = None
+) -> Dict[str, Any]:
+    """Refresh an expiring or rejected access token, coalescing concurrent refreshes"""
+    async with refresh_lock(user_id):
+        # Another request may have refreshed while we waited for the lock
+        current = await get_user_tokens(user_id)
+        if (
+            current is not None
+            and not token_expiring(current)
+            and current.get("access_token") != rejected_access_token
+        ):
+            return current
+        tokens = current or tokens
+        if "refresh_token" not in tokens:
+            return tokens
+        
+        refresh_data = {
+            "client_id": GOOGLE_CLIENT_ID,
+            "client_secret": GOOGLE_CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": tokens["refresh_token"],
+        }
+        response = await google_request("Google OAuth", "POST", GOOGLE_TOKEN_URL, data=refresh_data)
+        if response.status_code in RETRYABLE_UPSTREAM_STATUSES or response.status_code >= 500:
+            raise upstream_error("Google OAuth", response)
+        refreshed = orjson.loads(response.content)
+        if "access_token" not in refreshed:
+            raise HTTPException(status_code=401, detail="Failed to refresh access token")
+        
+        # Google omits the refresh token from refresh responses, so keep the old one
+        tokens = {**tokens, **refreshed}
+        await save_user_tokens(user_id, tokens)
+        return tokens
+
+async def get_valid_user_tokens(user_id: str) -> Optional[Dict[str, Any]]:
+    """Get stored tokens, refreshing the access token if it is about to expire"""
+    tokens = await get_user_tokens(user_id)
+    if tokens is not None and token_expiring(tokens):
+        tokens = await refresh_user_tokens(user_id, tokens)
+    return tokens
 
 @app.get("/")
 async def root():
@@ -62,163 +327,323 @@ async def health_check():
 @app.get("/auth/google")
 async def google_auth(request: Request):
     """Initiate Google OAuth flow"""
-    try:
-        # Get the current domain from the request
-        base_url = str(request.base_url).rstrip('/')
-        redirect_uri = f"{base_url}/auth/google/callback"
-        
-        # OAuth 2.0 scopes
-        scopes = [
-            'openid',
-            'email',
-            'profile',
-            'https://www.googleapis.com/auth/gmail.readonly',
-            'https://www.googleapis.com/auth/calendar.readonly',
-            'https://www.googleapis.com/auth/drive.readonly'
-        ]
-        
-        # Build authorization URL
-        auth_url = (
-            f"https://accounts.google.com/o/oauth2/auth?"
-            f"client_id={GOOGLE_CLIENT_ID}&"
-            f"redirect_uri={redirect_uri}&"
-            f"scope={'+'.join(scopes)}&"
-            f"response_type=code&"
-            f"access_type=offline&"
-            f"prompt=consent"
-        )
-        
-        return {"auth_url": auth_url}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OAuth initiation failed: {str(e)}")
+    # Get the current domain from the request
+    base_url = str(request.base_url).rstrip('/')
+    
+    return {"auth_url": google_auth_url(base_url)}
 
 @app.get("/auth/google/callback")
 async def google_callback(code: str, request: Request):
     """Handle Google OAuth callback"""
     try:
         base_url = str(request.base_url).rstrip('/')
-        redirect_uri = f"{base_url}/auth/google/callback"
         
         # Exchange code for tokens
-        token_url = "https://oauth2.googleapis.com/token"
         token_data = {
             "client_id": GOOGLE_CLIENT_ID,
             "client_secret": GOOGLE_CLIENT_SECRET,
             "code": code,
             "grant_type": "authorization_code",
-            "redirect_uri": redirect_uri,
+            "redirect_uri": oauth_redirect_uri(base_url),
         }
         
-        token_response = requests.post(token_url, data=token_data)
-        tokens = token_response.json()
+        token_response = await google_client.post(GOOGLE_TOKEN_URL, data=token_data)
+        tokens = orjson.loads(token_response.content)
         
         if "access_token" not in tokens:
             raise HTTPException(status_code=400, detail="Failed to get access token")
         
-        # Get user info
-        user_info_response = requests.get(
-            f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={tokens['access_token']}"
-        )
-        user_info = user_info_response.json()
+        # The id_token came straight from Google's token endpoint over TLS, so the
+        # signature check can be skipped, but it must still be issued by Google for
+        # this client. Fall back to userinfo when there is no id_token
+        if "id_token" in tokens:
+            claims = jwt.decode(tokens["id_token"], verify=False)
+            audience = claims.get("aud")
+            audiences = audience if isinstance(audience, list) else [audience]
+            if claims.get("iss") not in GOOGLE_ID_TOKEN_ISSUERS or GOOGLE_CLIENT_ID not in audiences:
+                raise HTTPException(status_code=400, detail="Invalid ID token")
+            user_id = claims.get("sub")
+        else:
+            user_info_response = await google_client.get(
+                GOOGLE_USERINFO_URL,
+                params={"access_token": tokens["access_token"]}
+            )
+            user_info = orjson.loads(user_info_response.content)
+            user_id = user_info.get("id")
         
-        # Store tokens (use proper database in production)
-        user_id = user_info.get("id")
-        user_tokens[user_id] = tokens
+        if not user_id:
+            raise HTTPException(status_code=400, detail="Failed to identify Google user")
+        
+        # Store tokens
+        await save_user_tokens(user_id, tokens)
         
         # Redirect back to frontend with success
-        frontend_url = "https://v0-google-integration-chatbot.vercel.app"
-        return RedirectResponse(url=f"{frontend_url}?auth=success&user_id={user_id}")
+        return RedirectResponse(url=f"{FRONTEND_URL}?auth=success&user_id={user_id}")
         
     except Exception as e:
-        frontend_url = "https://v0-google-integration-chatbot.vercel.app"
-        return RedirectResponse(url=f"{frontend_url}?auth=error&message={str(e)}")
+        # The user lands here from Google's consent screen, so report failures
+        # back to the frontend rather than as a bare error response
+        logger.exception("OAuth callback failed")
+        message = e.detail if isinstance(e, HTTPException) else "OAuth callback failed"
+        return RedirectResponse(url=f"{FRONTEND_URL}?{urlencode({'auth': 'error', 'message': message})}")
 
 @app.get("/auth/status")
 async def auth_status(user_id: str):
     """Check authentication status"""
-    if user_id in user_tokens:
+    if await redis_client.exists(token_key(user_id)):
         return {"connected": True, "services": ["gmail", "calendar", "drive"]}
     return {"connected": False, "services": []}
 
+CHAT_SYSTEM_PROMPT = "You are a helpful assistant that can access Google services like Gmail, Calendar, and Drive. Analyze user requests and provide helpful responses."
+
+# Intent keywords compiled into one pattern, listed in priority order
+INTENT_PATTERN = re.compile(
+    r"(?P<gmail>email|mail|gmail)"
+    r"|(?P<calendar>calendar|schedule|meeting)"
+    r"|(?P<drive>drive|file|document)",
+    re.IGNORECASE
+)
+INTENT_PRIORITY = ("gmail", "calendar", "drive")
+
+def detect_intent(text: str) -> Optional[str]:
+    """Simple keyword-based intent detection"""
+    found = set()
+    for match in INTENT_PATTERN.finditer(text):
+        if match.lastgroup == INTENT_PRIORITY[0]:
+            return match.lastgroup
+        found.add(match.lastgroup)
+    return next((intent for intent in INTENT_PRIORITY if intent in found), None)
+
+async def cerebras_completion(user_message: str) -> str:
+    """Request a single chat completion from Cerebras"""
+    try:
+        result = await require_cerebras_client().chat.completions.create(
+            model="llama3.1-8b",
+            messages=[
+                {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+                {"role": "user", "content": user_message}
+            ],
+            max_tokens=500,
+            temperature=0.7
+        )
+    except APIStatusError as e:
+        raise upstream_error("Cerebras", e.response)
+    except APIConnectionError as e:
+        raise upstream_unavailable("Cerebras", e)
+    
+    return result.choices[0].message.content
+
 @app.post("/chat")
 async def chat(message: ChatMessage):
     """Process chat message with Cerebras AI"""
+    ai_response = await cerebras_completion(message.message)
+    
+    intent = detect_intent(message.message)
+    
+    return ChatResponse(response=ai_response, intent=intent)
+
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage):
+    """Stream a Cerebras chat response as server-sent events"""
     try:
-        # Call Cerebras API
-        headers = {
-            "Authorization": f"Bearer {CEREBRAS_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "llama3.1-8b",
-            "messages": [
-                {"role": "system", "content": "You are a helpful assistant that can access Google services like Gmail, Calendar, and Drive. Analyze user requests and provide helpful responses."},
+        stream = await require_cerebras_client().chat.completions.create(
+            model="llama3.1-8b",
+            messages=[
+                {"role": "system", "content": CHAT_SYSTEM_PROMPT},
                 {"role": "user", "content": message.message}
             ],
-            "max_tokens": 500,
-            "temperature": 0.7
-        }
-        
-        response = requests.post(
-            "https://api.cerebras.ai/v1/chat/completions",
-            headers=headers,
-            json=payload
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
         )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Cerebras API error: {response.text}")
-        
-        result = response.json()
-        ai_response = result["choices"][0]["message"]["content"]
-        
-        # Simple intent detection
-        intent = None
-        if any(word in message.message.lower() for word in ["email", "mail", "gmail"]):
-            intent = "gmail"
-        elif any(word in message.message.lower() for word in ["calendar", "schedule", "meeting"]):
-            intent = "calendar"
-        elif any(word in message.message.lower() for word in ["drive", "file", "document"]):
-            intent = "drive"
-        
-        return ChatResponse(response=ai_response, intent=intent)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
+    except APIStatusError as e:
+        raise upstream_error("Cerebras", e.response)
+    except APIConnectionError as e:
+        raise upstream_unavailable("Cerebras", e)
+    
+    async def event_stream():
+        # Each event carries a JSON-encoded token chunk so newlines survive SSE framing
+        try:
+            async for chunk in stream:
+                # Upstream failures mid-stream arrive as error chunks without choices
+                error = getattr(chunk, "error", None)
+                if error is not None:
+                    logger.warning("Cerebras stream error %s: %s", chunk.status_code, error.message)
+                    yield b"event: error\ndata: " + orjson.dumps({"detail": "Cerebras API error"}) + b"\n\n"
+                    break
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta is not None and delta.content:
+                    yield b"data: " + orjson.dumps({"content": delta.content}) + b"\n\n"
+        except APIStatusError as e:
+            # The SDK raises error events from the upstream stream as status errors
+            logger.warning("Cerebras stream error %s: %s", e.status_code, e.message)
+            yield b"event: error\ndata: " + orjson.dumps({"detail": "Cerebras API error"}) + b"\n\n"
+        except (APIConnectionError, httpx.TransportError) as e:
+            logger.warning("Cerebras stream interrupted: %r", e)
+            yield b"event: error\ndata: " + orjson.dumps({"detail": "Cerebras API unavailable"}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+    
+    # Intent is known from the prompt alone, so send it up front as a header
+    headers = {"Cache-Control": "no-cache"}
+    intent = detect_intent(message.message)
+    if intent:
+        headers["X-Chat-Intent"] = intent
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+# Gmail cache TTLs: the inbox listing changes, fetched message headers don't
+GMAIL_LIST_TTL_SECONDS = 60
+GMAIL_MESSAGE_TTL_SECONDS = 3600
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+def check_gmail_response(response: httpx.Response):
+    """Raise the client-facing error for a failed Gmail API response"""
+    if response.status_code == 401:
+        raise HTTPException(status_code=401, detail="Google authorization expired or revoked")
+    if response.is_error:
+        raise upstream_error("Gmail", response)
+
+async def call_gmail(user_id: str, tokens: Dict[str, Any], fetch, *args):
+    """Run a Gmail call, refreshing the access token once if Google rejects it.
+
+    Covers tokens stored without an expiry as well as ones revoked or expired
+    early; `tokens` is updated in place so later calls use the new token.
+    """
+    try:
+        return await fetch(tokens["access_token"], *args)
+    except HTTPException as e:
+        if e.status_code != 401:
+            raise
+        rejected = tokens["access_token"]
+        refreshed = await refresh_user_tokens(user_id, tokens, rejected_access_token=rejected)
+        if refreshed.get("access_token") == rejected:
+            raise
+        tokens.update(refreshed)
+        return await fetch(tokens["access_token"], *args)
+
+async def list_gmail_message_ids(access_token: str, limit: int) -> List[str]:
+    """List ids of the most recent Gmail messages"""
+    response = await google_request(
+        "Gmail",
+        "GET",
+        f"{GMAIL_API_URL}/messages",
+        params={"maxResults": limit},
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    check_gmail_response(response)
+    messages = orjson.loads(response.content).get('messages', [])[:5]  # Limit to 5 for demo
+    return [msg['id'] for msg in messages]
+
+async def fetch_gmail_email(access_token: str, message_id: str) -> Dict[str, Any]:
+    """Fetch the subject, sender and snippet of a single message"""
+    response = await google_request(
+        "Gmail",
+        "GET",
+        f"{GMAIL_API_URL}/messages/{message_id}",
+        params=[("format", "metadata"), ("metadataHeaders", "Subject"), ("metadataHeaders", "From")],
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    check_gmail_response(response)
+    message = orjson.loads(response.content)
+    headers = message['payload'].get('headers', [])
+    
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+    
+    return {
+        'id': message_id,
+        'subject': subject,
+        'sender': sender,
+        'snippet': message.get('snippet', '')
+    }
+
+async def fetch_gmail_emails(access_token: str, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Fetch several messages concurrently, multiplexed over one HTTP/2 connection"""
+    emails = await asyncio.gather(
+        *(fetch_gmail_email(access_token, message_id) for message_id in message_ids)
+    )
+    return {email['id']: email for email in emails}
 
 @app.get("/google/gmail")
-async def get_gmail_messages(user_id: str, limit: int = 10):
+async def get_gmail_messages(user_id: str, limit: int = Query(10, ge=1, le=500)):
     """Get Gmail messages"""
+    # Token and cached listing lookups are independent, so run them together
+    list_key = f"gmail:list:{user_id}:{limit}"
+    tokens, cached_ids = await asyncio.gather(
+        get_valid_user_tokens(user_id),
+        redis_client.get(list_key)
+    )
+    if tokens is None:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    
+    if cached_ids is not None:
+        message_ids = orjson.loads(cached_ids)
+    else:
+        message_ids = await call_gmail(user_id, tokens, list_gmail_message_ids, limit)
+        await redis_client.set(list_key, orjson.dumps(message_ids), ex=GMAIL_LIST_TTL_SECONDS)
+    
+    if not message_ids:
+        return {"emails": []}
+    
+    # Look up all cached messages in one round-trip, fetch only the misses
+    cached = await redis_client.mget([f"gmail:msg:{user_id}:{message_id}" for message_id in message_ids])
+    emails = {
+        message_id: orjson.loads(raw)
+        for message_id, raw in zip(message_ids, cached)
+        if raw is not None
+    }
+    missing = [message_id for message_id in message_ids if message_id not in emails]
+    if missing:
+        fetched = await call_gmail(user_id, tokens, fetch_gmail_emails, missing)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for message_id, email in fetched.items():
+                pipe.set(f"gmail:msg:{user_id}:{message_id}", orjson.dumps(email), ex=GMAIL_MESSAGE_TTL_SECONDS)
+            await pipe.execute()
+        emails.update(fetched)
+    
+    email_list = [emails[message_id] for message_id in message_ids]
+    
+    return {"emails": email_list}
+
+async def dispatch_batch_item(item: BatchRequestItem) -> BatchResponseItem:
+    """Run a single batch sub-request against the app in-process"""
+    # Sub-requests address this API by path; reject absolute or malformed URLs
+    # per item so one bad entry doesn't fail the rest of the batch
+    if not item.url.startswith("/") or item.url.startswith("//"):
+        return BatchResponseItem(id=item.id, status=400, body={"detail": "Invalid request URL"})
     try:
-        if user_id not in user_tokens:
-            raise HTTPException(status_code=401, detail="User not authenticated")
-        
-        tokens = user_tokens[user_id]
-        credentials = Credentials(token=tokens["access_token"])
-        
-        service = build('gmail', 'v1', credentials=credentials)
-        results = service.users().messages().list(userId='me', maxResults=limit).execute()
-        messages = results.get('messages', [])
-        
-        email_list = []
-        for msg in messages[:5]:  # Limit to 5 for demo
-            message = service.users().messages().get(userId='me', id=msg['id']).execute()
-            headers = message['payload'].get('headers', [])
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            
-            email_list.append({
-                'id': msg['id'],
-                'subject': subject,
-                'sender': sender,
-                'snippet': message.get('snippet', '')
-            })
-        
-        return {"emails": email_list}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gmail access failed: {str(e)}")
+        response = await batch_client.request(
+            item.method.upper(),
+            item.url,
+            json=item.body
+        )
+    except (httpx.InvalidURL, httpx.UnsupportedProtocol):
+        return BatchResponseItem(id=item.id, status=400, body={"detail": "Invalid request URL"})
+    
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = orjson.loads(response.content)
+    else:
+        body = response.text
+    return BatchResponseItem(id=item.id, status=response.status_code, body=body)
+
+@app.post("/batch")
+async def batch(batch_request: BatchRequest, request: Request):
+    """Execute several API requests in one round-trip"""
+    if BATCH_SUBREQUEST_HEADER in request.headers:
+        raise HTTPException(status_code=400, detail="Nested batch requests are not allowed")
+    if len(batch_request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {BATCH_MAX_REQUESTS} requests")
+    
+    responses = await asyncio.gather(
+        *(dispatch_batch_item(item) for item in batch_request.requests)
+    )
+    return BatchResponse(responses=responses)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        workers=int(os.getenv("WEB_CONCURRENCY", 4))
+    )